@@ -106,7 +106,7 @@ def intercluster_distance(embeddings, labels, plot=True, save_path=None):
         return fig, inter_distances 
     return inter_distances
 
-def density(embeddings, threshold=0.95, n_neighbors=10, plot=True, save_path=None):
+def density(embeddings, threshold=0.95, n_neighbors=10, plot=True, save_path=None, index=None, chunk=65536):
     try:
         import faiss
         FAISS_AVAILABLE = True
@@ -114,13 +114,17 @@ def density(embeddings, threshold=0.95, n_neighbors=10, plot=True, save_path=Non
         from sklearn.neighbors import NearestNeighbors
         FAISS_AVAILABLE = False
 
-    if FAISS_AVAILABLE:
+    if index is not None:
+        emb = embeddings
+    elif FAISS_AVAILABLE:
         emb = embeddings.astype(np.float32)
         faiss.normalize_L2(emb)
         index = faiss.IndexFlatIP(emb.shape[1])
         index.add(emb)
-        distances, _ = index.search(emb, n_neighbors + 1)
-        similarities = 1 - distances[:, 1:]
+    if index is not None:
+        from core import search_index, drop_self_matches
+        distances, indices = search_index(index, emb, n_neighbors + 1, chunk=chunk)
+        similarities, _ = drop_self_matches(distances, indices, n_neighbors)
         density_count = np.sum(similarities >= threshold, axis=1)
     else:
         nn = NearestNeighbors(n_neighbors=n_neighbors, metric="cosine")
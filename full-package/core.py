@@ -1,24 +1,104 @@
+import math
+import os
+import warnings
 import numpy as np
 try:
     import faiss
     FAISS_AVAILABLE = True
+    if hasattr(getattr(faiss, "SIMDConfig", None), "has_dynamic_dispatch") and faiss.SIMDConfig.has_dynamic_dispatch():
+        FAISS_SIMD_LEVEL = faiss.SIMDConfig.get_level_name()
+    elif hasattr(faiss, "get_compile_options") and not os.environ.get("FAISS_OPT_LEVEL"):
+        FAISS_SIMD_LEVEL = faiss.get_compile_options()
+    else:
+        FAISS_SIMD_LEVEL = None
+    if FAISS_SIMD_LEVEL is not None and "AVX512" not in FAISS_SIMD_LEVEL:
+        warnings.warn("FAISS is running without AVX-512 kernels; similarity search will use the slower AVX2/generic path.")
 except ImportError:
     from sklearn.neighbors import NearestNeighbors
     FAISS_AVAILABLE = False
-from sklearn.ensemble import IsolationForest
-from sentence_transformers import SentenceTransformer
-from sklearn.decomposition import PCA
-import umap
-import matplotlib.pyplot as plt
+EMBEDDING_DTYPES = {"fp32": np.float32, "fp16": np.float16}
+try:
+    import ml_dtypes
+    EMBEDDING_DTYPES["bf16"] = ml_dtypes.bfloat16
+except ImportError:
+    pass
+from sklearn.decomposition import PCA, IncrementalPCA
+
+NUMBA_MIN_ROWS = 1_000_000
+
+def _collect_duplicates(similarities, indices, threshold):
+    collect_duplicates = None
+    if similarities.shape[0] >= NUMBA_MIN_ROWS:
+        try:
+            from kernels import collect_duplicates
+        except ImportError:
+            pass
+    if collect_duplicates is not None:
+        i_arr, j_arr, s_arr = collect_duplicates(similarities, indices.astype(np.int64, copy=False), threshold)
+    else:
+        rows = np.arange(similarities.shape[0])[:, None]
+        keep = (similarities >= threshold) & (indices > rows)
+        i_arr, j_arr, s_arr = np.broadcast_to(rows, indices.shape)[keep], indices[keep], similarities[keep]
+    return list(zip(i_arr.tolist(), j_arr.tolist(), s_arr.tolist()))
+
+def _blocked_knn(emb, k, block_bytes=16 * 2**20):
+    n = emb.shape[0]
+    k = min(k, n)
+    block = max(1, block_bytes // (4 * n))
+    similarities = np.empty((n, k), dtype=np.float32)
+    indices = np.empty((n, k), dtype=np.int64)
+    for start in range(0, n, block):
+        sims = emb[start:start + block] @ emb.T
+        rows = np.arange(sims.shape[0])
+        sims[rows, start + rows] = np.inf
+        top = np.argpartition(sims, -k, axis=1)[:, -k:]
+        top_sims = np.take_along_axis(sims, top, axis=1)
+        order = np.argsort(-top_sims, axis=1)
+        indices[start:start + block] = np.take_along_axis(top, order, axis=1)
+        similarities[start:start + block] = np.take_along_axis(top_sims, order, axis=1)
+    similarities[:, 0] = 1
+    return similarities, indices
+
+def search_index(index, queries, k, chunk=65536):
+    n = queries.shape[0]
+    similarities = np.empty((n, k), dtype=np.float32)
+    indices = np.empty((n, k), dtype=np.int64)
+    for start in range(0, n, chunk):
+        index.search(queries[start:start + chunk], k, D=similarities[start:start + chunk], I=indices[start:start + chunk])
+    return similarities, indices
+
+def drop_self_matches(similarities, indices, n_neighbors):
+    keep = (indices != np.arange(indices.shape[0])[:, None]) & (indices >= 0)
+    keep &= np.cumsum(keep, axis=1) <= n_neighbors
+    order = np.argsort(~keep, axis=1, kind="stable")[:, :n_neighbors]
+    keep = np.take_along_axis(keep, order, axis=1)
+    similarities = np.where(keep, np.take_along_axis(similarities, order, axis=1), np.nan)
+    indices = np.where(keep, np.take_along_axis(indices, order, axis=1), -1)
+    return similarities, indices
 
 class Embedx:
-    def __init__(self, embeddings: np.ndarray, verbose: bool = True, timestamps = None, labels = None):
+    def __init__(self, embeddings: np.ndarray, verbose: bool = True, timestamps = None, labels = None, dtype = None):
+        if dtype is not None:
+            if dtype not in EMBEDDING_DTYPES:
+                raise ValueError(f"Unknown or unavailable dtype: {dtype}")
+            embeddings = embeddings.astype(EMBEDDING_DTYPES[dtype], copy=False)
+        self._version = 0
         self.embeddings = embeddings
         self.n_samples, self.n_dim = embeddings.shape
         self.verbose = verbose
         self.timestamps = timestamps
         self.labels = labels
 
+    @property
+    def embeddings(self):
+        return self._embeddings
+
+    @embeddings.setter
+    def embeddings(self, value):
+        self._embeddings = value
+        self._is_normalized = False
+        self._invalidate_caches()
+
     def set_labels(self, labels):
         self.labels = labels
 
@@ -30,23 +110,50 @@ class Embedx:
         return self.n_samples, self.n_dim
 
     @staticmethod
-    def generate_embeddings(texts, model_name="all-MiniLM-L6-v2", output_path="embeddings.npy"):
-        model = SentenceTransformer(model_name)
-        embeddings = model.encode(texts, batch_size=32, show_progress_bar=True)
+    def generate_embeddings(texts, model_name="all-MiniLM-L6-v2", output_path="embeddings.npy", batch_size=None):
+        import torch
+        from sentence_transformers import SentenceTransformer
+        device = "cuda" if torch.cuda.is_available() else "cpu"
+        model = SentenceTransformer(model_name, device=device)
+        if device == "cuda":
+            model.half()
+        if batch_size is None:
+            batch_size = 256 if device == "cuda" else 64
+        embeddings = model.encode(texts, batch_size=batch_size, show_progress_bar=True, convert_to_numpy=True, normalize_embeddings=True)
+        if device == "cuda":
+            embeddings = embeddings.astype(np.float16, copy=False)
         np.save(output_path, embeddings)
         return embeddings
 
     @staticmethod
-    def load_embeddings(path):
+    def load_embeddings(path, mmap=False):
         if path.endswith(".npy"):
-            return np.load(path)
+            return np.load(path, mmap_mode="r" if mmap else None)
         elif path.endswith(".csv"):
-            return np.loadtxt(path, delimiter=",")
+            import pandas as pd
+            return pd.read_csv(path, header=None, dtype=np.float32, engine="c").to_numpy()
         else:
             raise ValueError("Unknown file format: must be .npy or .csv")
     
+    def _cached_norms(self):
+        if self._norms is not None and self._norms_sig == self._version:
+            return self._norms
+        return None
+
+    def _row_norms(self, chunk=8192):
+        norms = self._cached_norms()
+        if norms is not None:
+            return norms
+        acc_dtype = np.float64 if self.embeddings.dtype == np.float64 else np.float32
+        norms = np.empty(self.n_samples, dtype=acc_dtype)
+        for start in range(0, self.n_samples, chunk):
+            block = self.embeddings[start:start + chunk].astype(acc_dtype, copy=False)
+            norms[start:start + chunk] = np.sqrt(np.einsum("ij,ij->i", block, block))
+        self._norms, self._norms_sig = norms, self._version
+        return norms
+
     def basic_stats(self):
-        norms = np.linalg.norm(self.embeddings, axis=1)
+        norms = self._row_norms()
         if self.verbose:
             print(f"Embedding shape: {self.embeddings.shape}")
             print(f"Mean norm: {norms.mean():.4f}")
@@ -57,53 +164,111 @@ class Embedx:
             "std_norm": norms.std()
         }
     
-    def find_duplicates(self, threshold=0.99, neighbors=10):
-        if FAISS_AVAILABLE:
-            emb = self.embeddings.astype(np.float32).copy()
-            faiss.normalize_L2(emb)
+    def _build_index(self, k=None, m=32, ef_construction=40, ef_search=None, nprobe=16, fp16=True):
+        params = (m, ef_construction, fp16)
+        emb = self._normalized_fp32()
+        if self._index is None or self._index_params != params or self._index_sig != self._version:
+            self._index = self._make_index(emb, m=m, ef_construction=ef_construction, fp16=fp16)
+            self._index_params, self._index_sig = params, self._version
+        index = self._index
+        if isinstance(index, faiss.IndexHNSW) and k is not None:
+            index.hnsw.efSearch = ef_search if ef_search is not None else max(16, k)
+        elif faiss.try_extract_index_ivf(index) is not None:
+            faiss.extract_index_ivf(index).nprobe = nprobe
+        return index, emb
+
+    def _make_index(self, emb, m=32, ef_construction=40, fp16=True):
+        if self.n_samples < 50_000 and fp16:
+            index = faiss.IndexScalarQuantizer(self.n_dim, faiss.ScalarQuantizer.QT_fp16, faiss.METRIC_INNER_PRODUCT)
+            index.train(emb)
+        elif self.n_samples < 50_000:
             index = faiss.IndexFlatIP(self.n_dim)
-            index.add(emb)
-            distances, indices = index.search(emb, neighbors + 1)
-
-            duplicates = []
-            for i, (dist_row, index_row) in enumerate(zip(distances, indices)):
-                for dist, index in zip(dist_row[1:], index_row[1:]):
-                    if dist >= threshold:
-                        if i < index:
-                            duplicates.append((i, index, dist))
+        elif self.n_samples >= 2_000_000:
+            nlist = int(4 * math.sqrt(self.n_samples))
+            codec = f"PQ{self.n_dim // 4}x8" if self.n_dim % 4 == 0 else "SQ8"
+            index = faiss.index_factory(self.n_dim, f"IVF{nlist},{codec},RFlat", faiss.METRIC_INNER_PRODUCT)
+            index.k_factor = 4
+            index.train(emb)
+        elif fp16:
+            index = faiss.IndexHNSWSQ(self.n_dim, faiss.ScalarQuantizer.QT_fp16, m, faiss.METRIC_INNER_PRODUCT)
+            index.hnsw.efConstruction = ef_construction
+            index.train(emb)
+        else:
+            index = faiss.IndexHNSWFlat(self.n_dim, m, faiss.METRIC_INNER_PRODUCT)
+            index.hnsw.efConstruction = ef_construction
+        index.add(emb)
+        return index
+
+    def _normalized_fp32(self):
+        if self.embeddings.dtype == np.float32 and self._is_normalized:
+            return np.ascontiguousarray(self.embeddings)
+        emb = np.array(self.embeddings, dtype=np.float32, order="C", copy=True)
+        norms = np.sqrt(np.einsum("ij,ij->i", emb, emb))
+        norms[norms == 0] = 1
+        emb /= norms[:, None]
+        return emb
+
+    def _invalidate_caches(self):
+        self._version += 1
+        self._index = None
+        self._index_params = None
+        self._index_sig = None
+        self._norms = None
+        self._norms_sig = None
+
+    def find_duplicates(self, threshold=0.99, neighbors=10, m=32, ef_construction=40, ef_search=None, nprobe=16):
+        if self.n_samples < 50_000:
+            similarities, indices = _blocked_knn(self._normalized_fp32(), neighbors + 1)
+        elif FAISS_AVAILABLE:
+            index, emb = self._build_index(k=neighbors + 1, m=m, ef_construction=ef_construction, ef_search=ef_search, nprobe=nprobe, fp16=threshold >= 0.9)
+            similarities, indices = search_index(index, emb, neighbors + 1)
         else:                    
             nn = NearestNeighbors(n_neighbors=neighbors, metric="cosine")
-            nn.fit(self.embeddings)
-            distances, indices = nn.kneighbors(self.embeddings)
-
-            duplicates = []
-            for i, (dist_row, index_row) in enumerate(zip(distances, indices)):
-                for dist, index in zip(dist_row[1:], index_row[1:]):
-                    if (1 - dist) >= threshold:
-                        if i < index:
-                            duplicates.append((i, index, 1 - dist))
+            emb = self._normalized_fp32()
+            nn.fit(emb)
+            distances, indices = nn.kneighbors(emb)
+            similarities = 1 - distances
+
+        duplicates = _collect_duplicates(similarities, indices, threshold)
         
         if self.verbose:
             print(f"Found {len(duplicates)} near-duplicates")
         return duplicates
     
-    def remove_duplicates(self, threshold=0.99, neighbors=10):
-        duplicates = self.find_duplicates(threshold=threshold, neighbors=neighbors)
+    def remove_duplicates(self, threshold=0.99, neighbors=10, **kwargs):
+        duplicates = self.find_duplicates(threshold=threshold, neighbors=neighbors, **kwargs)
         removing = {index for (_, index, _) in duplicates}
         if self.verbose:
             print(f"Removing {len(removing)} near-duplicates")
         self._remove_indices(removing)
 
-    def find_outliers(self, contamination=0.01):
-        iso = IsolationForest(contamination=contamination, random_state=42)
-        preds = iso.fit_predict(self.embeddings)
-        outliers = np.where(preds == -1)[0]
+    def find_outliers(self, contamination=0.01, n_neighbors=10):
+        if isinstance(contamination, str) or not 0 < contamination <= 0.5:
+            raise ValueError(f"contamination must be a number in (0, 0.5], got {contamination!r}")
+        k = min(n_neighbors + 1, self.n_samples)
+        if FAISS_AVAILABLE:
+            index, emb = self._build_index(k=k)
+            similarities, indices = search_index(index, emb, k)
+        else:
+            nn = NearestNeighbors(n_neighbors=k, metric="cosine")
+            emb = self._normalized_fp32()
+            nn.fit(emb)
+            distances, indices = nn.kneighbors(emb)
+            similarities = 1 - distances
+        similarities, indices = drop_self_matches(similarities, indices, n_neighbors)
+        found = indices >= 0
+        scores = -np.where(found, similarities, 0).sum(axis=1) / np.maximum(found.sum(axis=1), 1)
+        n_outliers = int(contamination * self.n_samples)
+        if n_outliers == 0:
+            outliers = np.array([], dtype=np.int64)
+        else:
+            outliers = np.sort(np.argpartition(scores, -n_outliers)[-n_outliers:])
         if self.verbose:
             print(f"Found {len(outliers)} outliers")
         return outliers
     
-    def remove_outliers(self, contamination=0.01):
-        outliers = self.find_outliers(contamination=contamination)
+    def remove_outliers(self, contamination=0.01, n_neighbors=10):
+        outliers = self.find_outliers(contamination=contamination, n_neighbors=n_neighbors)
         if self.verbose:
             print(f"Removing {len(outliers)} outliers")
         self._remove_indices(outliers)
@@ -113,9 +278,17 @@ class Embedx:
             if self.verbose:
                 print("Zero embeddings removed.")
             return
+        if isinstance(removing, np.ndarray):
+            idx = removing.astype(np.int64, copy=False)
+        else:
+            idx = np.fromiter(removing, dtype=np.int64, count=len(removing))
         mask = np.ones(self.n_samples, dtype=bool)
-        mask[list(removing)] = False
-        self.embeddings = self.embeddings[mask]
+        mask[idx] = False
+        norms, is_normalized = self._cached_norms(), self._is_normalized
+        self.embeddings = np.compress(mask, self.embeddings, axis=0)
+        self._is_normalized = is_normalized
+        if norms is not None:
+            self._norms, self._norms_sig = norms[mask], self._version
         if self.timestamps is not None:
             self.timestamps = self.timestamps[mask]
         if self.labels is not None:
@@ -142,7 +315,11 @@ class Embedx:
 
     def visualize_neighbors(self, threshold=0.95, n_neighbors=10, save_path=None, display=False):
         from visualization import visualize_neighbors
-        fig, similarity, neighbors = visualize_neighbors(self.embeddings, threshold=threshold, n_neighbors=n_neighbors, save_path=save_path)
+        if FAISS_AVAILABLE:
+            index, emb = self._build_index(k=n_neighbors + 1, fp16=threshold >= 0.9)
+            fig, similarity, neighbors = visualize_neighbors(emb, threshold=threshold, n_neighbors=n_neighbors, save_path=save_path, index=index)
+        else:
+            fig, similarity, neighbors = visualize_neighbors(self._normalized_fp32(), threshold=threshold, n_neighbors=n_neighbors, save_path=save_path)
         if display:
             fig.show()
         return fig, similarity, neighbors
@@ -168,20 +345,41 @@ class Embedx:
 
     def center(self):
         mean = np.mean(self.embeddings, axis=0, keepdims = True)
+        if not self.embeddings.flags.writeable:
+            self.embeddings = self.embeddings.copy()
         self.embeddings -= mean
         if self.verbose:
             print("Centered embeddings at mean")
     
-    def normalize(self, method="l2"):
-        if method == "l2":
-            norms = np.linalg.norm(self.embeddings, axis=1, keepdims = True)
-        elif method == "l1":
-            norms = np.sum(np.abs(self.embeddings), axis=1, keepdims = True)
-        else:
+    def normalize(self, method="l2", chunk=8192):
+        if method not in ("l2", "l1"):
             raise ValueError(f"Cannot normalize with unknown method: {method}")
-        
-        norms[norms == 0] = 1
-        self.embeddings = self.embeddings/norms
+        if self.embeddings.dtype.kind in "iub":
+            self.embeddings = self.embeddings.astype(np.float64)
+        elif not self.embeddings.flags.writeable:
+            self.embeddings = self.embeddings.copy()
+
+        acc_dtype = np.float64 if self.embeddings.dtype == np.float64 else np.float32
+        cached = self._cached_norms() if method == "l2" else None
+        unit_norms = np.empty(self.n_samples, dtype=acc_dtype) if method == "l2" else None
+        for start in range(0, self.n_samples, chunk):
+            block = self.embeddings[start:start + chunk]
+            if cached is not None:
+                norms = cached[start:start + chunk].astype(acc_dtype)
+            elif method == "l2":
+                values = block.astype(acc_dtype, copy=False)
+                norms = np.sqrt(np.einsum("ij,ij->i", values, values))
+            else:
+                norms = np.abs(block.astype(acc_dtype, copy=False)).sum(axis=1)
+            if unit_norms is not None:
+                unit_norms[start:start + chunk] = norms != 0
+            norms[norms == 0] = 1
+            np.reciprocal(norms, out=norms)
+            block *= norms[:, None]
+        self._invalidate_caches()
+        self._is_normalized = method == "l2"
+        if unit_norms is not None:
+            self._norms, self._norms_sig = unit_norms, self._version
         if self.verbose:
             print(f"{method} normalization applied to embeddings.")
 
@@ -189,15 +387,30 @@ class Embedx:
         if n_components is None or n_components > self.n_dim:
             n_components = self.n_dim
             print(f"Setting n_components to default {self.n_dim}")
-        pca = PCA(n_components=n_components, whiten=whiten, random_state=3)
+        if n_components < self.n_dim * 0.5:
+            pca = PCA(n_components=n_components, whiten=whiten, svd_solver="randomized", random_state=3)
+        elif self.n_samples > 200_000:
+            pca = IncrementalPCA(n_components=n_components, whiten=whiten, batch_size=max(4096, n_components))
+            for batch in np.array_split(self.embeddings, max(1, self.n_samples // pca.batch_size)):
+                pca.partial_fit(batch)
+        else:
+            pca = PCA(n_components=n_components, whiten=whiten, random_state=3)
         if transform:
-            self.embeddings = pca.fit_transform(self.embeddings)
+            X, self.embeddings = self.embeddings, None
+            try:
+                out = pca.transform(X) if isinstance(pca, IncrementalPCA) else pca.fit_transform(X)
+            except Exception:
+                self.embeddings = X
+                raise
+            del X
+            self.embeddings = out
             self.n_dim = self.embeddings.shape[1]
             print(f"Post-PCA dim = {self.n_dim}")
-        else:
+        elif not isinstance(pca, IncrementalPCA):
             pca.fit(self.embeddings)
 
         if plot_variance:
+            import matplotlib.pyplot as plt
             explained = np.cumsum(pca.explained_variance_ratio_)
             fig, ax = plt.subplots(figsize=(8, 6))
             ax.plot(np.arange(1, len(explained)+1), explained, marker='o')
@@ -265,7 +478,11 @@ class Embedx:
     
     def density(self, threshold, n_neighbors, plot=True, save_path=None, display=False):
         from advanced import density
-        fig, similarity, dens = density(self.embeddings, threshold=threshold, n_neighbors=n_neighbors, plot=plot, save_path=save_path)
+        if FAISS_AVAILABLE:
+            index, emb = self._build_index(k=n_neighbors + 1, fp16=threshold >= 0.9)
+            fig, similarity, dens = density(emb, threshold=threshold, n_neighbors=n_neighbors, plot=plot, save_path=save_path, index=index)
+        else:
+            fig, similarity, dens = density(self._normalized_fp32(), threshold=threshold, n_neighbors=n_neighbors, plot=plot, save_path=save_path)
         if display:
             fig.show()
         return fig, similarity, dens
@@ -0,0 +1,24 @@
+import numpy as np
+from numba import njit, prange
+
+@njit(parallel=True, cache=True)
+def collect_duplicates(similarities, indices, threshold):
+    n, k = similarities.shape
+    counts = np.zeros(n + 1, dtype=np.int64)
+    for i in prange(n):
+        for j in range(k):
+            if similarities[i, j] >= threshold and i < indices[i, j]:
+                counts[i + 1] += 1
+    offsets = np.cumsum(counts)
+    out_i = np.empty(offsets[n], dtype=np.int64)
+    out_j = np.empty(offsets[n], dtype=np.int64)
+    out_s = np.empty(offsets[n], dtype=similarities.dtype)
+    for i in prange(n):
+        p = offsets[i]
+        for j in range(k):
+            if similarities[i, j] >= threshold and i < indices[i, j]:
+                out_i[p] = i
+                out_j[p] = indices[i, j]
+                out_s[p] = similarities[i, j]
+                p += 1
+    return out_i, out_j, out_s
@@ -1,4 +1,3 @@
-import umap
 import numpy as np
 import pandas as pd
 try:
@@ -30,6 +29,7 @@ def visualize_umap(embeddings, n_samples, dim=2, labels=None, save_path=None):
         print("UMAPs must be in 2D or 3D")
 
 def visualize_umap_2d(embeddings, n_samples, labels=None, save_path=None):
+    import umap
     reduce = umap.UMAP(n_components=2, n_neighbors=min(15, n_samples-1), random_state=3)
     embeddings_2d = reduce.fit_transform(embeddings)
 
@@ -61,6 +61,7 @@ def visualize_umap_2d(embeddings, n_samples, labels=None, save_path=None):
     return fig
 
 def visualize_umap_3d(embeddings, n_samples, labels=None, save_path=None):
+    import umap
     reduce = umap.UMAP(n_components=3, n_neighbors=min(15, n_samples-1), random_state=3)
     embeddings_3d = reduce.fit_transform(embeddings)
 
@@ -161,16 +162,19 @@ def visualize_clusters(embeddings, n_samples, labels=None, method="umap", dim=2,
     elif (method == "tsne"):
         return visualize_tsne(embeddings, n_samples, dim, labels, save_path)
 
-def visualize_neighbors(embeddings, threshold=0.95, n_neighbors=10, save_path=None):
-    if FAISS_AVAILABLE:
+def visualize_neighbors(embeddings, threshold=0.95, n_neighbors=10, save_path=None, index=None, chunk=65536):
+    if index is not None:
+        emb = embeddings
+    elif FAISS_AVAILABLE:
         emb = embeddings.astype(np.float32)
         faiss.normalize_L2(emb)
 
         index = faiss.IndexFlatIP(emb.shape[1])
         index.add(emb)
-
-        distances, indices = index.search(emb, k=n_neighbors + 1)
-        similarities = 1 - distances[:, 1:]
+    if index is not None:
+        from core import search_index, drop_self_matches
+        distances, indices = search_index(index, emb, n_neighbors + 1, chunk=chunk)
+        similarities, indices = drop_self_matches(distances, indices, n_neighbors)
         num_neighbors_close = np.sum(similarities >= threshold, axis = 1)
     else:
         nn = NearestNeighbors(n_neighbors=n_neighbors, metric="cosine")